@@ -1,6 +1,8 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, jsonify, request, send_from_directory, g
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import exc 
+from sqlalchemy import exc, create_engine, event, func, distinct, text
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import NullPool
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
@@ -8,19 +10,55 @@ from flask_jwt_extended import JWTManager, create_access_token, jwt_required, ge
 from datetime import date, datetime, timedelta
 from functools import wraps
 import os
+import click
+import sqlite3
+import tempfile
+import threading
+import time
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///library.sqlite3'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('LIBRARY_DATABASE_URI', 'sqlite:///library.sqlite3')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = 'your_jwt_secret_key'
 app.config['UPLOAD_FOLDER'] = 'media'
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif'}
+# Max age (seconds) of the read snapshot per read-only route, 0 = read from the primary
+app.config['READ_STALENESS'] = {
+    '/loans': 30,
+    '/late-loans': 300,
+    '/users': 60,
+}
+app.config['READ_STALENESS_DEFAULT'] = 30
+app.config['RELATED_BOOKS_TOP_K'] = 10
 
 CORS(app)
 
 db = SQLAlchemy(app)
 jwt = JWTManager(app)
 
+
+# WAL lets the snapshot copy (and other readers) run without blocking writers
+def enable_wal(dbapi_connection, connection_record):
+    dbapi_connection.execute('PRAGMA journal_mode=WAL')
+
+with app.app_context():
+    event.listen(db.engine, 'connect', enable_wal)
+    primary_path = db.engine.url.database
+    app.config['READ_SNAPSHOT_PATH'] = f'{os.path.splitext(primary_path)[0]}_snapshot.sqlite3'
+
+# Read-only reports are served from a snapshot copy of the primary database.
+# NullPool: every session opens the current snapshot file, so a replaced file is picked up at once.
+os.makedirs(app.instance_path, exist_ok=True)
+read_engine = create_engine(f"sqlite:///{app.config['READ_SNAPSHOT_PATH']}", poolclass=NullPool)
+ReadSession = scoped_session(sessionmaker(bind=read_engine))
+snapshot_lock = threading.Lock()
+snapshot_taken_at = None
+snapshot_refreshing = False
+
+@app.teardown_appcontext
+def remove_read_session(exception=None):
+    ReadSession.remove()
+
 class Users(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -59,8 +97,26 @@ class Loans(db.Model):
     book = db.relationship('Books', backref=db.backref('loans', lazy=True))
     user = db.relationship('Users', backref=db.backref('loans', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_loans_user_book', 'user_id', 'book_id'),
+        db.Index('ix_loans_book_user', 'book_id', 'user_id'),
+    )
+
     def __repr__(self):
         return f'<Loan {self.id}>'
+
+
+# Top-K "patrons who borrowed this also borrowed" neighbours per book,
+# score = number of distinct patrons who borrowed both books
+class RelatedBooks(db.Model):
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), primary_key=True)
+    related_book_id = db.Column(db.Integer, db.ForeignKey('books.id'), primary_key=True)
+    score = db.Column(db.Integer, nullable=False)
+
+    related_book = db.relationship('Books', foreign_keys=[related_book_id])
+
+    def __repr__(self):
+        return f'<RelatedBooks {self.book_id} -> {self.related_book_id}>'
     
 #Creating media directory..    
 if not os.path.exists('media'):
@@ -96,6 +152,139 @@ def admin_required(fn):
     return wrapper
 
 
+# Copy the primary into a temporary file and swap it in, so readers of the old snapshot never block the copy
+def refresh_snapshot():
+    global snapshot_taken_at
+    snapshot_path = app.config['READ_SNAPSHOT_PATH']
+    taken_at = time.time()
+    # Named after the snapshot so a copy left behind by a killed process is still git-ignored
+    fd, tmp_path = tempfile.mkstemp(prefix=f'{os.path.basename(snapshot_path)}.', suffix='.tmp', dir=os.path.dirname(snapshot_path))
+    os.close(fd)
+    try:
+        source = sqlite3.connect(primary_path)
+        target = sqlite3.connect(tmp_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        os.replace(tmp_path, snapshot_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    snapshot_taken_at = taken_at
+
+    elapsed = time.time() - taken_at
+    bounds = [age for age in [*app.config['READ_STALENESS'].values(), app.config['READ_STALENESS_DEFAULT']] if age > 0]
+    if bounds and elapsed > min(bounds):
+        app.logger.warning(f'Snapshot copy took {elapsed:.1f}s, longer than the smallest READ_STALENESS bound ({min(bounds)}s)')
+
+
+def run_snapshot_refresh():
+    global snapshot_refreshing
+    try:
+        refresh_snapshot()
+    except Exception as e:
+        app.logger.error(f'Snapshot refresh failed: {e}')
+    finally:
+        with snapshot_lock:
+            snapshot_refreshing = False
+
+
+# Start a copy in the background unless one is already running, so requests never wait for it
+def request_snapshot_refresh():
+    global snapshot_refreshing
+    with snapshot_lock:
+        if snapshot_refreshing:
+            return
+        snapshot_refreshing = True
+    threading.Thread(target=run_snapshot_refresh, daemon=True).start()
+
+
+# Read-only decorator: routes the endpoint's queries (g.read_session) to the snapshot.
+# Falls back to the primary while the snapshot is missing or older than the route allows.
+def read_only(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        rule = request.url_rule.rule
+        max_age = app.config['READ_STALENESS'].get(rule, app.config['READ_STALENESS_DEFAULT'])
+        if max_age <= 0:
+            g.read_session = db.session
+            return fn(*args, **kwargs)
+
+        age = None if snapshot_taken_at is None else time.time() - snapshot_taken_at
+        # Copies only happen on demand: refresh once the snapshot is past half the route's bound,
+        # so steady report traffic keeps finding a fresh one and idle processes copy nothing
+        if age is None or age > max_age / 2:
+            request_snapshot_refresh()
+
+        if age is not None and age <= max_age:
+            g.read_session = ReadSession()
+        else:
+            if age is not None:
+                app.logger.warning(f'Read snapshot is {age:.0f}s old, over the {max_age}s bound for {rule}; reading from the primary')
+            g.read_session = db.session
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+# Merge exact co-occurrence counts ({related_book_id: score}) into a book's stored top-K rows
+# ({related_book_id: RelatedBooks}). Counts only grow, so a lower count computed by a concurrent
+# loan never overwrites a higher stored one.
+def merge_related_books(book_id, counts, stored):
+    top_k = app.config['RELATED_BOOKS_TOP_K']
+    scores = {related_id: row.score for related_id, row in stored.items()}
+    for related_id, score in counts.items():
+        scores[related_id] = max(score, scores.get(related_id, 0))
+    keep = dict(sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top_k])
+
+    for related_id, row in stored.items():
+        if related_id not in keep:
+            db.session.delete(row)
+        else:
+            row.score = keep[related_id]
+    for related_id, score in keep.items():
+        if related_id not in stored:
+            db.session.add(RelatedBooks(book_id=book_id, related_book_id=related_id, score=score))
+
+
+# Incremental update for a new, already committed loan. Only pairs between the loaned book and the
+# patron's other books change, so their exact counts are recomputed and merged into both rows.
+# The counts are plain reads (no write lock in WAL mode); only the top-K merge is a write transaction.
+def update_related_books(loan):
+    user_id, book_id = loan.user_id, loan.book_id
+
+    # Co-occurrence counts distinct patrons, so borrowing the same book again changes nothing
+    if Loans.query.filter(Loans.user_id == user_id, Loans.book_id == book_id, Loans.id < loan.id).first():
+        return
+
+    # Walk the book's distinct borrowers and probe each one's loans through ix_loans_user_book,
+    # instead of scanning every loan of every book in the patron's history
+    history = db.session.query(Loans.book_id).filter(Loans.user_id == user_id, Loans.book_id != book_id)
+    borrowers = db.session.query(Loans.user_id).filter(Loans.book_id == book_id).distinct().subquery()
+    counts = dict(
+        db.session.query(Loans.book_id, func.count(distinct(Loans.user_id)))
+        .select_from(borrowers)
+        .join(Loans, Loans.user_id == borrowers.c.user_id)
+        .filter(Loans.book_id.in_(history))
+        .group_by(Loans.book_id)
+        .all()
+    )
+    if not counts:
+        return
+
+    # Take the write lock up front so the stored rows cannot change between read and merge
+    db.session.execute(text('BEGIN IMMEDIATE'))
+    stored = {related_book_id: {} for related_book_id in [book_id, *counts]}
+    for row in RelatedBooks.query.filter(RelatedBooks.book_id.in_(list(stored))).all():
+        stored[row.book_id][row.related_book_id] = row
+
+    merge_related_books(book_id, counts, stored[book_id])
+    for other_id, score in counts.items():
+        merge_related_books(other_id, {book_id: score}, stored[other_id])
+    db.session.commit()
+
+
 # Register endpoint
 @app.route('/register', methods=['POST'])
 def register():
@@ -238,6 +427,13 @@ def loan_book():
         db.session.add(new_loan)
         db.session.commit()
 
+        # RelatedBooks is derived data: a failed update must not fail the committed loan
+        try:
+            update_related_books(new_loan)
+        except exc.SQLAlchemyError as e:
+            db.session.rollback()
+            app.logger.error(f'Related books update failed for loan {new_loan.id}: {e}')
+
         return jsonify({"message": "Book loaned successfully"}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -293,15 +489,47 @@ def get_books():
         return jsonify(result), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+
+# Patrons who borrowed this also borrowed
+@app.route('/books/<int:book_id>/related', methods=['GET'])
+def get_related_books(book_id):
+    try:
+        if not Books.query.filter_by(id=book_id, is_active=True).first():
+            return jsonify({"error": "Book not found"}), 404
+
+        related = (
+            db.session.query(RelatedBooks.score, Books)
+            .join(Books, Books.id == RelatedBooks.related_book_id)
+            .filter(RelatedBooks.book_id == book_id, Books.is_active == True)
+            .order_by(RelatedBooks.score.desc(), Books.id)
+            .all()
+        )
+        result = [
+            {
+                'id': book.id,
+                'title': book.title,
+                'author': book.author,
+                'published_year': book.published_year,
+                'image_url': book.image_url,
+                'type': book.type,
+                'available': book.available,
+                'borrowed_together': score,
+            } for score, book in related
+        ]
+        return jsonify(result), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
     
   
 # Display all users endpoint
 @app.route('/users', methods=['GET'])
 @jwt_required()
+@read_only
 def get_users():
     try:
         current_user = get_jwt_identity()
-        users = Users.query.filter_by(is_active=True).all()
+        users = g.read_session.query(Users).filter_by(is_active=True).all()
         if current_user['role'] == 'admin':
             result = [
                 {
@@ -351,6 +579,7 @@ def my_profile():
 
 @app.route('/loans', methods=['GET'])
 @jwt_required()
+@read_only
 def get_loans():
     try:
         current_user = get_jwt_identity()
@@ -358,9 +587,9 @@ def get_loans():
 
         if user.role == 'admin':
             # For admin, fetch all loans
-            loans = Loans.query.all()
+            loans = g.read_session.query(Loans).all()
         else:
-            # For regular users, fetch only their own loans
+            # For regular users, fetch only their own loans (from the primary, so their own loans/returns show up at once)
             loans = Loans.query.filter_by(user_id=user.id).all()
 
         result = []
@@ -386,6 +615,7 @@ def get_loans():
 
 @app.route('/late-loans', methods=['GET'])
 @jwt_required()
+@read_only
 def get_late_loans():
     try:
         current_user = get_jwt_identity()
@@ -395,9 +625,9 @@ def get_late_loans():
 
         if user.role == 'admin':
             # For admin, fetch all late loans
-            loans = Loans.query.filter(Loans.return_date == None).all()
+            loans = g.read_session.query(Loans).filter(Loans.return_date == None).all()
         else:
-            # For regular users, fetch only their own late loans
+            # For regular users, fetch only their own late loans (from the primary, like /loans)
             loans = Loans.query.filter_by(user_id=user.id, return_date=None).all()
 
         result = []
@@ -690,6 +920,103 @@ def update_user(user_id):
         return jsonify({"error": str(e)}), 500
 
 
+# Stream (id, user_id, book_id) rows in chunks to avoid building millions of Python tuples at once.
+# The primary is in WAL mode, so this read does not block writers.
+def read_loans(connection):
+    import numpy as np
+
+    cursor = connection.execute('SELECT id, user_id, book_id FROM loans')
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(1_000_000)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.int64))
+    return np.concatenate(chunks) if chunks else np.empty((0, 3), dtype=np.int64)
+
+
+# Offline batch job: flask --app app build-related-books
+@app.cli.command('build-related-books')
+@click.option('--block-size', default=4096, help='Books per co-occurrence block.')
+def build_related_books(block_size):
+    """Rebuild RelatedBooks from the full Loans history."""
+    import numpy as np
+    from scipy import sparse
+
+    top_k = app.config['RELATED_BOOKS_TOP_K']
+    table = RelatedBooks.__tablename__
+    staging_table = f'{table}_staging'
+    started = time.time()
+
+    connection = sqlite3.connect(primary_path)
+    try:
+        loans = read_loans(connection)
+
+        connection.execute(f'DROP TABLE IF EXISTS {staging_table}')
+        connection.execute(f'CREATE TABLE {staging_table} (book_id INTEGER, related_book_id INTEGER, score INTEGER)')
+        connection.commit()
+
+        last_loan_id = int(loans[:, 0].max()) if len(loans) else 0
+        user_ids, book_ids = loans[:, 1], loans[:, 2]
+        n_books = int(book_ids.max()) + 1 if len(loans) else 0
+
+        if len(loans):
+            # Binary patron x book matrix: repeat loans of the same book count once
+            patrons = sparse.csr_matrix(
+                (np.ones(len(loans), dtype=np.int32), (user_ids, book_ids)),
+                shape=(int(user_ids.max()) + 1, n_books),
+            )
+            patrons.data[:] = 1
+            books = patrons.T.tocsr()
+
+        stored = 0
+        for start in range(0, n_books, block_size):
+            # Co-occurrence rows for this block of books: (books x patrons) @ (patrons x books)
+            block = (books[start:start + block_size] @ patrons).tocoo()
+            rows = block.row.astype(np.int64) + start
+            cols = block.col.astype(np.int64)
+            scores = block.data
+            not_self = rows != cols
+            rows, cols, scores = rows[not_self], cols[not_self], scores[not_self]
+
+            # Sort by book, then score descending (ties by related id) and keep the first top_k per book
+            order = np.lexsort((cols, -scores, rows))
+            rows, cols, scores = rows[order], cols[order], scores[order]
+            rank = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+            keep = rank < top_k
+            rows, cols, scores = rows[keep], cols[keep], scores[keep]
+
+            # One short write transaction per block, into a table nothing else uses
+            connection.executemany(
+                f'INSERT INTO {staging_table} (book_id, related_book_id, score) VALUES (?, ?, ?)',
+                zip(rows.tolist(), cols.tolist(), scores.tolist()),
+            )
+            connection.commit()
+            stored += len(rows)
+    finally:
+        connection.close()
+
+    # Swap the new table in with a single short transaction
+    db.session.query(RelatedBooks).delete()
+    db.session.execute(text(
+        f'INSERT INTO {table} (book_id, related_book_id, score) '
+        f'SELECT book_id, related_book_id, score FROM {staging_table}'
+    ))
+    db.session.execute(text(f'DROP TABLE {staging_table}'))
+    db.session.commit()
+
+    # Loans committed after the read above updated the old table, so re-apply them, one short
+    # transaction each like /loan-book. Loans committed after the swap already updated the new table.
+    new_loans = Loans.query.filter(Loans.id > last_loan_id).order_by(Loans.id).all()
+    for loan in new_loans:
+        update_related_books(loan)
+
+    click.echo(
+        f'Stored {stored} related books from {len(loans)} loans '
+        f'(+{len(new_loans)} newer loans re-applied) in {time.time() - started:.1f}s.'
+    )
+
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()    
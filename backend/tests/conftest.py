@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Point the app at a throwaway database before it is imported
+os.environ['LIBRARY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.sqlite3')}"
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask_jwt_extended import create_access_token
+
+from app import app, db
+
+
+@pytest.fixture
+def fresh_db():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app
+
+
+@pytest.fixture
+def app_context(fresh_db):
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def auth_headers(monkeypatch):
+    # Identities are dicts; newer flask-jwt-extended only accepts them with subject checks off
+    monkeypatch.setitem(app.config, 'JWT_VERIFY_SUB', False)
+
+    def headers(username, role='user'):
+        with app.app_context():
+            token = create_access_token(identity={'username': username, 'role': role})
+        return {'Authorization': f'Bearer {token}'}
+    return headers
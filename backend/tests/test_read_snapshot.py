@@ -0,0 +1,74 @@
+import os
+import time
+
+import pytest
+
+import app as app_module
+from app import app, db, Users, Books, Loans, refresh_snapshot
+
+
+@pytest.fixture
+def library(fresh_db, auth_headers, monkeypatch):
+    # Refreshes are triggered explicitly, not by background threads
+    monkeypatch.setattr(app_module, 'request_snapshot_refresh', lambda: None)
+    monkeypatch.setattr(app_module, 'snapshot_taken_at', None)
+    with app.app_context():
+        db.session.add_all([
+            Users(username='admin', password='x', email='admin@example.com', role='admin'),
+            Users(username='patron', password='x', email='patron@example.com'),
+            Books(title='Book 1', author='Author', type=1),
+            Books(title='Book 2', author='Author', type=1),
+        ])
+        db.session.commit()
+    return {'admin': auth_headers('admin', 'admin'), 'patron': auth_headers('patron')}
+
+
+def add_loan():
+    with app.app_context():
+        db.session.add(Loans(user_id=2, book_id=1))
+        db.session.commit()
+
+
+def loan_count(headers):
+    response = app.test_client().get('/loans', headers=headers)
+    assert response.status_code == 200, response.json
+    return len(response.json)
+
+
+def test_admin_loans_come_from_a_fresh_snapshot(library):
+    refresh_snapshot()
+    add_loan()
+
+    assert loan_count(library['admin']) == 0
+
+    refresh_snapshot()
+    assert loan_count(library['admin']) == 1
+    snapshot_dir = os.path.dirname(app.config['READ_SNAPSHOT_PATH'])
+    assert not [name for name in os.listdir(snapshot_dir) if name.endswith('.tmp')]
+
+
+def test_admin_loans_read_the_primary_once_the_snapshot_is_too_old(library, monkeypatch):
+    refresh_snapshot()
+    add_loan()
+    max_age = app.config['READ_STALENESS']['/loans']
+
+    monkeypatch.setattr(app_module, 'snapshot_taken_at', time.time() - max_age - 1)
+    assert loan_count(library['admin']) == 1
+
+
+def test_admin_loans_read_the_primary_when_the_bound_is_zero(library, monkeypatch):
+    refresh_snapshot()
+    add_loan()
+
+    monkeypatch.setitem(app.config, 'READ_STALENESS', {**app.config['READ_STALENESS'], '/loans': 0})
+    assert loan_count(library['admin']) == 1
+
+
+def test_patron_loans_always_read_the_primary(library):
+    refresh_snapshot()
+    client = app.test_client()
+    response = client.post('/loan-book', json={'book_id': 2}, headers=library['patron'])
+    assert response.status_code == 201, response.json
+
+    assert loan_count(library['patron']) == 1
+    assert loan_count(library['admin']) == 0
@@ -0,0 +1,103 @@
+import random
+
+import app as app_module
+from app import app, db, Users, Books, Loans, RelatedBooks, update_related_books, build_related_books
+
+
+def related_rows():
+    return sorted(
+        (row.book_id, row.related_book_id, row.score)
+        for row in RelatedBooks.query.all()
+    )
+
+
+def rebuild():
+    result = app.test_cli_runner().invoke(build_related_books, ['--block-size', '7'])
+    assert result.exit_code == 0, result.output
+    return result
+
+
+def add_users_and_books(n_users, n_books):
+    db.session.add_all([Users(username=f'user{i}', password='x', email=f'user{i}@example.com') for i in range(n_users)])
+    db.session.add_all([Books(title=f'Book {i}', author='Author', type=1) for i in range(n_books)])
+    db.session.commit()
+
+
+# Same order as /loan-book: commit the loan, then update RelatedBooks
+def loan(user_id, book_id):
+    new_loan = Loans(user_id=user_id, book_id=book_id)
+    db.session.add(new_loan)
+    db.session.commit()
+    update_related_books(new_loan)
+    return new_loan
+
+
+def random_loans(rng, count):
+    return [loan(rng.randint(1, 40), rng.randint(1, 30)) for _ in range(count)]
+
+
+def test_incremental_updates_match_batch_job(app_context, monkeypatch):
+    # A small top-K so that eviction from the stored neighbours is exercised
+    monkeypatch.setitem(app.config, 'RELATED_BOOKS_TOP_K', 3)
+    add_users_and_books(40, 30)
+    random_loans(random.Random(1), 300)
+    incremental = related_rows()
+
+    rebuild()
+
+    assert incremental
+    assert related_rows() == incremental
+
+
+def test_repeat_loan_does_not_change_scores(app_context):
+    add_users_and_books(3, 3)
+    loan(1, 1)
+    loan(1, 2)
+    loan(2, 1)
+    loan(2, 2)
+    loan(2, 3)
+    before = related_rows()
+    assert (1, 2, 2) in before
+
+    loan(1, 1)
+    loan(2, 3)
+
+    assert related_rows() == before
+
+
+def test_reapplying_a_loan_changes_nothing(app_context, monkeypatch):
+    monkeypatch.setitem(app.config, 'RELATED_BOOKS_TOP_K', 3)
+    add_users_and_books(40, 30)
+    loans = random_loans(random.Random(2), 200)
+    before = related_rows()
+
+    for reapplied in loans[::10]:
+        update_related_books(reapplied)
+
+    assert related_rows() == before
+    rebuild()
+    assert related_rows() == before
+
+
+def test_batch_job_reapplies_loans_committed_after_its_read(app_context, monkeypatch):
+    monkeypatch.setitem(app.config, 'RELATED_BOOKS_TOP_K', 3)
+    add_users_and_books(40, 30)
+    rng = random.Random(3)
+    random_loans(rng, 200)
+
+    # Loans that arrive while the job computes update the old table, which the swap then replaces
+    read_loans = app_module.read_loans
+
+    def read_then_loan(connection):
+        loans = read_loans(connection)
+        random_loans(rng, 50)
+        return loans
+
+    monkeypatch.setattr(app_module, 'read_loans', read_then_loan)
+    result = rebuild()
+    assert '+50 newer loans re-applied' in result.output
+    after_job = related_rows()
+
+    monkeypatch.setattr(app_module, 'read_loans', read_loans)
+    rebuild()
+    assert related_rows() == after_job